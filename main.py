@@ -5,12 +5,27 @@ LOG_FORMAT = "%(asctime)s | %(levelname)-5s | %(name)s | %(message)s"
 LOG_DATE = "%Y-%m-%d %H:%M:%S"
 
 
+class _SecondCachedFormatter(logging.Formatter):
+    """LOG_DATE без долей секунды, поэтому asctime форматируется один раз в секунду и переиспользуется."""
+
+    _cache: tuple[int, str] = (-1, "")
+
+    def formatTime(self, record: logging.LogRecord, datefmt: str | None = None) -> str:
+        second = int(record.created)
+        cached_second, cached_text = self._cache
+        if second == cached_second:
+            return cached_text
+        text = super().formatTime(record, datefmt)
+        self._cache = (second, text)
+        return text
+
+
 def setup_logging(level: str = "INFO") -> None:
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(_SecondCachedFormatter(LOG_FORMAT, LOG_DATE))
     logging.basicConfig(
         level=getattr(logging, level.upper()),
-        format=LOG_FORMAT,
-        datefmt=LOG_DATE,
-        stream=sys.stdout,
+        handlers=[handler],
         force=True,
     )
     logging.getLogger("httpx").setLevel(logging.WARNING)
@@ -0,0 +1,10 @@
+-- Индексы под горячие запросы бота (для баз, созданных по старой schema.sql / payments.sql)
+
+-- Последние запросы пользователя (/info): WHERE user_id = ? ORDER BY created_at DESC
+ALTER TABLE requests
+    ADD INDEX idx_user_created (user_id, created_at),
+    DROP INDEX idx_user_id;
+
+-- Дубли UNIQUE-индексов: только замедляют запись
+ALTER TABLE users DROP INDEX idx_telegram_id;
+ALTER TABLE payments DROP INDEX idx_yookassa_payment_id;
@@ -8,7 +8,6 @@ CREATE TABLE IF NOT EXISTS payments (
     amount_rub DECIMAL(12, 2) NOT NULL,
     status VARCHAR(32) NOT NULL DEFAULT 'pending' COMMENT 'pending, succeeded, canceled',
     created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
-    INDEX idx_yookassa_payment_id (yookassa_payment_id),
     INDEX idx_telegram_status (telegram_id, status),
     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
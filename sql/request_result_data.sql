@@ -0,0 +1,4 @@
+-- Общие данные кампании (keywords, analysis_result) хранятся один раз на заказ, а не в каждой строке results
+
+ALTER TABLE requests
+    ADD COLUMN result_data JSON NULL COMMENT 'Общие данные кампании (keywords, analysis_result) для всех вариантов' AFTER `desc`;
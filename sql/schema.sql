@@ -10,8 +10,7 @@ CREATE TABLE IF NOT EXISTS users (
     language_code VARCHAR(16) NULL,
     is_bot TINYINT(1) NULL,
     is_premium TINYINT(1) NULL,
-    created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
-    INDEX idx_telegram_id (telegram_id)
+    created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
 CREATE TABLE IF NOT EXISTS requests (
@@ -19,8 +18,9 @@ CREATE TABLE IF NOT EXISTS requests (
     user_id INT UNSIGNED NOT NULL,
     link VARCHAR(512) NOT NULL COMMENT 'Ссылка на группу VK',
     `desc` TEXT NULL COMMENT 'Текстовое дополнение от пользователя',
+    result_data JSON NULL COMMENT 'Общие данные кампании (keywords, analysis_result) для всех вариантов',
     created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
-    INDEX idx_user_id (user_id),
+    INDEX idx_user_created (user_id, created_at),
     INDEX idx_created_at (created_at),
     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
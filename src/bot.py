@@ -1,14 +1,20 @@
 import asyncio
+import functools
 import io
 import json
 import logging
+import os
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Any
+from typing import Any, AsyncIterator, Iterator
 
-from PIL import Image
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update, User
-from telegram.ext import Application, CallbackQueryHandler, CommandHandler, ContextTypes, MessageHandler, filters
+from PIL import Image, ImageOps
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto, Message, Update, User
+from telegram.error import BadRequest, NetworkError
+from telegram.ext import AIORateLimiter, Application, CallbackQueryHandler, CommandHandler, ContextTypes, MessageHandler, filters
 
 from .campaign_generator import generate_campaign
 from .config import settings
@@ -19,15 +25,17 @@ from .db import (
     LOG_START,
     add_balance,
     create_payment_record,
-    create_request,
     create_results,
-    deduct_balance,
+    deduct_balance_and_create_request,
     ensure_user,
+    ensure_user_and_log,
     get_last_requests,
+    get_request_result_data,
     get_results_for_request,
     get_user_balance,
     log_action,
 )
+from .http_clients import close_http_clients
 from .models import AdVariant, CampaignDraft
 from .vk_client import fetch_group_analysis
 from .yookassa_client import create_payment as yookassa_create_payment
@@ -57,12 +65,14 @@ REGION_IDS_TO_NAMES: dict[str, str] = {
 }
 
 VK_LINK_PATTERN = re.compile(
-    r"(https?://)?(www\.)?vk\.(com|ru)/[^\s]+",
+    r"(https?://)?(?:www\.)?vk\.(?:com|ru)/\S+",
     re.IGNORECASE,
 )
+WHITESPACE_PATTERN = re.compile(r"\s+")
+REGION_ID_PATTERN = re.compile(r"[^,\s](?:[^,]*[^,\s])?")
 
 BUSY_MESSAGE = "Дождись окончания генерации"
-GENERATION_STATE_KEY = "generation_state"
+QUEUED_MESSAGE = "Сейчас много заказов — ваш поставлен в очередь и начнёт создаваться, как только освободится место."
 GENERATION_COST_RUB = 500
 INSUFFICIENT_BALANCE_MESSAGE = (
     f"Недостаточно средств на балансе. Стоимость одной генерации — {GENERATION_COST_RUB} ₽. "
@@ -146,6 +156,11 @@ MIN_TOPUP = 100
 MAX_TOPUP = 100_000
 
 
+_CAMPAIGN_SEMAPHORE = asyncio.Semaphore(max(1, settings.max_concurrent_campaigns))
+# Цикл событий держит задачи только по слабым ссылкам.
+_CAMPAIGN_TASKS: set[asyncio.Task] = set()
+
+
 def _ensure_user_kwargs(user: User | None) -> dict[str, Any]:
     if user is None:
         return {}
@@ -159,48 +174,44 @@ def _ensure_user_kwargs(user: User | None) -> dict[str, Any]:
     }
 
 
-def _get_generation_state(app: Application) -> dict[int, dict[str, Any]]:
-    state = app.bot_data.get(GENERATION_STATE_KEY)
-    if not isinstance(state, dict):
-        state = {}
-        app.bot_data[GENERATION_STATE_KEY] = state
-    return state
+@dataclass(slots=True)
+class GenerationState:
+    active: bool = True
+    request_id: int | None = None
+    result_sent: bool = False
+
+
+_GEN_STATE: dict[int, GenerationState] = {}
 
 
 def _is_generation_active(app: Application, chat_id: int) -> bool:
-    state = _get_generation_state(app)
-    data = state.get(chat_id)
-    return bool(data and data.get("active"))
+    data = _GEN_STATE.get(chat_id)
+    return data is not None and data.active
 
 
 def _register_generation(app: Application, chat_id: int, request_id: int | None) -> None:
-    state = _get_generation_state(app)
-    state[chat_id] = {"active": True, "request_id": request_id, "result_sent": False}
+    _GEN_STATE[chat_id] = GenerationState(request_id=request_id)
 
 
 def _should_send_results(app: Application, chat_id: int, request_id: int | None) -> bool:
-    state = _get_generation_state(app)
-    data = state.get(chat_id)
-    if not data:
+    data = _GEN_STATE.get(chat_id)
+    if data is None:
         return True
-    if data.get("result_sent"):
+    if data.result_sent:
         return False
-    stored_request_id = data.get("request_id")
-    if stored_request_id is not None and request_id is not None and stored_request_id != request_id:
+    if data.request_id is not None and request_id is not None and data.request_id != request_id:
         return False
     return True
 
 
 def _mark_results_sent(app: Application, chat_id: int) -> None:
-    state = _get_generation_state(app)
-    data = state.get(chat_id)
+    data = _GEN_STATE.get(chat_id)
     if data is not None:
-        data["result_sent"] = True
+        data.result_sent = True
 
 
 def _clear_generation_state(app: Application, chat_id: int) -> None:
-    state = _get_generation_state(app)
-    state.pop(chat_id, None)
+    _GEN_STATE.pop(chat_id, None)
 
 
 def parse_user_input(text: str) -> tuple[str | None, str | None]:
@@ -209,22 +220,23 @@ def parse_user_input(text: str) -> tuple[str | None, str | None]:
     raw = (text or "").strip()
     if not raw:
         return None, None
+    if "vk." not in raw.lower():
+        return None, None
     match = VK_LINK_PATTERN.search(raw)
     if not match:
         return None, None
     link = match.group(0)
-    if not link.startswith("http"):
+    if not match.group(1):
         link = "https://" + link
     rest = (raw[: match.start()] + " " + raw[match.end() :]).strip()
-    rest = re.sub(r"\s+", " ", rest) if rest else None
+    rest = WHITESPACE_PATTERN.sub(" ", rest) if rest else None
     return link, rest or None
 
 
 def _region_ids_to_text(region_ids: str | None) -> str:
     if not region_ids:
         return "—"
-    parts = [p.strip() for p in str(region_ids).split(",") if p.strip()]
-    names = [REGION_IDS_TO_NAMES.get(p, p) for p in parts]
+    names = [REGION_IDS_TO_NAMES.get(p, p) for p in REGION_ID_PATTERN.findall(str(region_ids))]
     return ", ".join(names) if names else region_ids
 
 
@@ -240,24 +252,30 @@ async def _run_campaign_task(
 ) -> None:
     logger.info("task start chat_id=%s link=%s ad_type=%s", chat_id, link, ad_type)
     try:
-        if not link or not str(link).strip():
-            raise ValueError("Ссылка на группу не указана. Отправьте ссылку на группу ВКонтакте (например, vk.com/group_name).")
-        logger.info("task: fetching VK group analysis")
-        analysis = fetch_group_analysis(link, posts_count=50)
-        logger.info("task: VK done group=%s posts=%s", analysis.group.name, len(analysis.posts))
-        draft = await generate_campaign(analysis, user_wishes=user_wishes, ad_objective=ad_type)
-        if request_id is not None:
-            await create_results(request_id, draft)
-        if user_id is not None:
-            await log_action(user_id, LOG_ORDER_DONE)
-        logger.info("task: campaign generated, evaluating send guard")
-        if _should_send_results(app, chat_id, request_id):
-            logger.info("task: sending campaign to chat_id=%s", chat_id)
-            await _send_campaign(chat_id, draft, app)
-            _mark_results_sent(app, chat_id)
-        else:
-            logger.info("task: duplicate results suppressed chat_id=%s request_id=%s", chat_id, request_id)
-        logger.info("task done chat_id=%s", chat_id)
+        if _CAMPAIGN_SEMAPHORE.locked():
+            try:
+                await app.bot.send_message(chat_id=chat_id, text=QUEUED_MESSAGE)
+            except Exception as e:
+                logger.warning("queued notice to chat_id=%s failed: %s", chat_id, e)
+        async with _CAMPAIGN_SEMAPHORE:
+            if not link or not str(link).strip():
+                raise ValueError("Ссылка на группу не указана. Отправьте ссылку на группу ВКонтакте (например, vk.com/group_name).")
+            logger.info("task: fetching VK group analysis")
+            analysis = await fetch_group_analysis(link, posts_count=50)
+            logger.info("task: VK done group=%s posts=%s", analysis.group.name, len(analysis.posts))
+            draft = await generate_campaign(analysis, user_wishes=user_wishes, ad_objective=ad_type)
+            if request_id is not None:
+                await create_results(request_id, draft)
+            if user_id is not None:
+                await log_action(user_id, LOG_ORDER_DONE)
+            logger.info("task: campaign generated, evaluating send guard")
+            if _should_send_results(app, chat_id, request_id):
+                logger.info("task: sending campaign to chat_id=%s", chat_id)
+                await _send_campaign(chat_id, draft, app)
+                _mark_results_sent(app, chat_id)
+            else:
+                logger.info("task: duplicate results suppressed chat_id=%s request_id=%s", chat_id, request_id)
+            logger.info("task done chat_id=%s", chat_id)
     except ValueError as e:
         logger.warning("task error (ValueError): %s", e)
         await app.bot.send_message(chat_id=chat_id, text=f"Ошибка: {e}")
@@ -274,47 +292,40 @@ async def _run_campaign_task(
         _clear_generation_state(app, chat_id)
 
 
-def _format_ad_block(ad: AdVariant, index: int, draft: CampaignDraft) -> str:
-    vk = draft.analysis_result.get("vk_campaign") or {}
-    segments = draft.analysis_result.get("audience_segments") or []
-    seg = segments[index - 1] if index <= len(segments) else {}
-    age_range = seg.get("age_range") or f"{vk.get('age_from', 18)}–{vk.get('age_to', 55)}"
+def _start_campaign_task(*args: Any) -> None:
+    task = asyncio.create_task(_run_campaign_task(*args))
+    _CAMPAIGN_TASKS.add(task)
+    task.add_done_callback(_CAMPAIGN_TASKS.discard)
+
+
+def _format_ad_block(
+    ad: AdVariant,
+    index: int,
+    seg: dict[str, Any],
+    *,
+    regions_text: str,
+    default_age: str,
+    objective_text: str,
+) -> str:
+    age_range = seg.get("age_range") or default_age
     gender_raw = (seg.get("gender") or "all").lower()
     gender_text = "мужской" if gender_raw == "male" else "женский" if gender_raw == "female" else "все"
-    regions_text = _region_ids_to_text(vk.get("region_ids"))
-    objective_text = (
-        "Привлечь подписчиков" if draft.ad_objective == AD_TYPE_SUBSCRIBERS else "Принять заказы в сообщениях"
-    )
 
-    lines = [
-        f"━━━ Вариант {index} · {ad.segment_name} ━━━",
-        "",
-        "Целевая аудитория: " + (ad.segment_name or "—"),
-        "",
-        f"📌 Заголовок: {ad.headline}",
-        "",
-        "Текст:",
-        ad.body_text,
-        "",
-        "",
-        f"Визуальная концепция: {ad.visual_concept}",
-        "",
-    ]
-    if getattr(ad, "reasoning", "") and ad.reasoning.strip():
-        lines.extend([
-            "💡 Почему этот вариант:",
-            ad.reasoning.strip(),
-            "",
-        ])
-    lines.extend([
-        "── Параметры для создания объявления ──",
-        f"Цель кампании: {objective_text}",
-        f"Регионы: {regions_text}",
-        f"Возраст: {age_range}",
-        f"Пол: {gender_text}",
-        "",
-    ])
-    return "\n".join(lines)
+    reasoning = ad.reasoning.strip() if getattr(ad, "reasoning", "") else ""
+    reasoning_text = f"💡 Почему этот вариант:\n{reasoning}\n\n" if reasoning else ""
+    return (
+        f"━━━ Вариант {index} · {ad.segment_name} ━━━\n\n"
+        f"Целевая аудитория: {ad.segment_name or '—'}\n\n"
+        f"📌 Заголовок: {ad.headline}\n\n"
+        f"Текст:\n{ad.body_text}\n\n\n"
+        f"Визуальная концепция: {ad.visual_concept}\n\n"
+        f"{reasoning_text}"
+        "── Параметры для создания объявления ──\n"
+        f"Цель кампании: {objective_text}\n"
+        f"Регионы: {regions_text}\n"
+        f"Возраст: {age_range}\n"
+        f"Пол: {gender_text}\n"
+    )
 
 
 def _format_content_recommendations(recs: list[dict[str, str]]) -> str:
@@ -341,18 +352,37 @@ def _format_campaign_message(draft: CampaignDraft) -> list[str]:
     if draft.keywords:
         chunks.append("🏷 Ключевые слова для таргета: " + ", ".join(draft.keywords[:20]))
 
-    for i, ad in enumerate(draft.ads, 1):
-        block = _format_ad_block(ad, i, draft)
-        chunks.append(block)
-
+    vk = draft.analysis_result.get("vk_campaign") or {}
+    segments = draft.analysis_result.get("audience_segments") or []
+    regions_text = _region_ids_to_text(vk.get("region_ids"))
+    default_age = f"{vk.get('age_from', 18)}–{vk.get('age_to', 55)}"
+    objective_text = (
+        "Привлечь подписчиков" if draft.ad_objective == AD_TYPE_SUBSCRIBERS else "Принять заказы в сообщениях"
+    )
+    chunks.extend([
+        _format_ad_block(
+            ad,
+            i,
+            segments[i - 1] if i <= len(segments) else {},
+            regions_text=regions_text,
+            default_age=default_age,
+            objective_text=objective_text,
+        )
+        for i, ad in enumerate(draft.ads, 1)
+    ])
     return chunks
 
 
-def _draft_from_results(rows: list[dict[str, Any]], ad_objective: str = AD_TYPE_SUBSCRIBERS) -> CampaignDraft | None:
+def _draft_from_results(
+    rows: list[dict[str, Any]],
+    ad_objective: str = AD_TYPE_SUBSCRIBERS,
+    *,
+    result_data: str | None = None,
+) -> CampaignDraft | None:
     if not rows:
         return None
     draft = CampaignDraft(ad_objective=ad_objective)
-    first_data = rows[0].get("result_data")
+    first_data = result_data or rows[0].get("result_data")
     if first_data:
         try:
             data = json.loads(first_data) if isinstance(first_data, str) else first_data
@@ -375,26 +405,259 @@ def _draft_from_results(rows: list[dict[str, Any]], ad_objective: str = AD_TYPE_
     return draft
 
 
+REPLAY_CACHE_TTL = 300.0
+REPLAY_CACHE_SIZE = 512
+
+_REPLAY_CACHE: dict[int, tuple[float, CampaignDraft]] = {}
+
+
+async def _load_replay_draft(request_id: int) -> CampaignDraft | None:
+    now = time.monotonic()
+    cached = _REPLAY_CACHE.get(request_id)
+    if cached and now - cached[0] < REPLAY_CACHE_TTL:
+        return cached[1]
+    rows = await get_results_for_request(request_id)
+    result_data = None
+    if rows and not rows[0].get("result_data"):
+        result_data = await get_request_result_data(request_id)
+    draft = _draft_from_results(rows, result_data=result_data) if rows else None
+    if draft is not None:
+        _REPLAY_CACHE.pop(request_id, None)
+        _REPLAY_CACHE[request_id] = (now, draft)
+        if len(_REPLAY_CACHE) > REPLAY_CACHE_SIZE:
+            _REPLAY_CACHE.pop(next(iter(_REPLAY_CACHE)))
+    return draft
+
+
 CAPTION_LIMIT = 1024
 MESSAGE_LIMIT = 4096
-PHOTO_MAX_SIZE = 1024
-PHOTO_JPEG_QUALITY = 75
+PHOTO_MAX_SIZE = settings.photo_max_size
+PHOTO_JPEG_QUALITY = settings.photo_jpeg_quality
+PHOTO_JPEG_PROGRESSIVE = settings.photo_jpeg_progressive
+PHOTO_PASSTHROUGH_MAX_BYTES = 500_000
+SEND_MAX_RETRIES = 3
 PHOTO_SEND_RETRIES = 3
 PHOTO_SEND_RETRY_DELAY = 3.0
+PHOTO_PREPARE_WORKERS = 2
+PHOTO_CACHE_SIZE = 64
+PHOTO_FILE_ID_CACHE_SIZE = 1024
+MEDIA_GROUP_LIMIT = 10
+TELEGRAM_POOL_SIZE = 256
+TELEGRAM_POOL_TIMEOUT = 20.0
+TELEGRAM_GET_UPDATES_POOL_SIZE = 8
+_PHOTO_EXECUTOR = ThreadPoolExecutor(max_workers=PHOTO_PREPARE_WORKERS, thread_name_prefix="photo")
+
+_PHOTO_FILE_IDS: dict[tuple[str, int], str] = {}
 
 
 def _prepare_photo_for_telegram(path: str) -> bytes:
     with Image.open(path) as img:
+        if (
+            img.format == "JPEG"
+            and img.mode in ("RGB", "L")
+            and "exif" not in img.info
+            and "icc_profile" not in img.info
+            and max(img.size) <= PHOTO_MAX_SIZE
+            and os.path.getsize(path) <= PHOTO_PASSTHROUGH_MAX_BYTES
+        ):
+            return Path(path).read_bytes()
+        img.draft("RGB", (PHOTO_MAX_SIZE, PHOTO_MAX_SIZE))
         img = img.convert("RGB")
-        w, h = img.size
-        if max(w, h) > PHOTO_MAX_SIZE:
-            ratio = PHOTO_MAX_SIZE / max(w, h)
-            img = img.resize((int(w * ratio), int(h * ratio)), Image.Resampling.LANCZOS)
+        img.thumbnail((PHOTO_MAX_SIZE, PHOTO_MAX_SIZE), Image.Resampling.LANCZOS)
+        # save() не переносит EXIF, поэтому поворот применяем к пикселям.
+        ImageOps.exif_transpose(img, in_place=True)
         buf = io.BytesIO()
-        img.save(buf, format="JPEG", quality=PHOTO_JPEG_QUALITY, optimize=True)
+        img.save(buf, format="JPEG", quality=PHOTO_JPEG_QUALITY, subsampling=2, progressive=PHOTO_JPEG_PROGRESSIVE)
         return buf.getvalue()
 
 
+def _tg_len(text: str) -> int:
+    """Длина в единицах UTF-16 — так Telegram считает лимиты (эмодзи занимают две)."""
+    return len(text) if text.isascii() else len(text.encode("utf-16-le")) // 2
+
+
+def _split_text(text: str, limit: int = MESSAGE_LIMIT) -> Iterator[str]:
+    if len(text) * 2 <= limit or _tg_len(text) <= limit:
+        yield text
+        return
+    start = 0
+    while start < len(text):
+        end = start + limit
+        excess = _tg_len(text[start:end]) - limit
+        while excess > 0:
+            end -= (excess + 1) // 2
+            excess = _tg_len(text[start:end]) - limit
+        if end < len(text):
+            newline = text.rfind("\n", start + (end - start) // 2, end)
+            if newline != -1:
+                end = newline + 1
+        yield text[start:end]
+        start = end
+
+
+def _pack_chunks(chunks: list[str], limit: int = MESSAGE_LIMIT, sep: str = "\n\n") -> Iterator[str]:
+    sep_len = _tg_len(sep)
+    current = ""
+    current_len = 0
+    for chunk in chunks:
+        chunk_len = _tg_len(chunk)
+        if current and current_len + sep_len + chunk_len <= limit:
+            current += sep + chunk
+            current_len += sep_len + chunk_len
+            continue
+        if current:
+            yield current
+        *head, current = _split_text(chunk, limit)
+        yield from head
+        current_len = chunk_len if not head else _tg_len(current)
+    if current:
+        yield current
+
+
+@dataclass(slots=True)
+class _PreparedPhoto:
+    key: tuple[str, int]  # (image_path, st_mtime_ns)
+    media: bytes | str  # JPEG или file_id
+
+
+def _remember_file_id(photo: _PreparedPhoto, message: Message | None) -> None:
+    if not isinstance(photo.media, bytes) or message is None or not message.photo:
+        return
+    _PHOTO_FILE_IDS[photo.key] = message.photo[-1].file_id
+    if len(_PHOTO_FILE_IDS) > PHOTO_FILE_ID_CACHE_SIZE:
+        _PHOTO_FILE_IDS.pop(next(iter(_PHOTO_FILE_IDS)))
+
+
+def _forget_file_id(photo: _PreparedPhoto) -> None:
+    if isinstance(photo.media, str):
+        _PHOTO_FILE_IDS.pop(photo.key, None)
+
+
+async def _send_photo_with_retry(app: Application, chat_id: int, caption: str, photo: _PreparedPhoto) -> Message:
+    # AIORateLimiter повторяет только RetryAfter; обрывы и таймауты загрузки повторяем здесь.
+    for attempt in range(1, PHOTO_SEND_RETRIES + 1):
+        try:
+            return await app.bot.send_photo(chat_id=chat_id, photo=photo.media, caption=caption)
+        except NetworkError as e:
+            if isinstance(e, BadRequest) or attempt == PHOTO_SEND_RETRIES:
+                raise
+            logger.warning("send_photo to chat_id=%s attempt %s/%s failed: %s", chat_id, attempt, PHOTO_SEND_RETRIES, e)
+            await asyncio.sleep(PHOTO_SEND_RETRY_DELAY)
+
+
+async def _send_one(app: Application, chat_id: int, text: str, photo: _PreparedPhoto | None = None) -> bool:
+    try:
+        if photo is None:
+            await app.bot.send_message(chat_id=chat_id, text=text)
+        else:
+            message = await _send_photo_with_retry(app, chat_id, text, photo)
+            _remember_file_id(photo, message)
+        return True
+    except Exception as e:
+        logger.warning("send to chat_id=%s (photo=%s) failed: %s", chat_id, photo is not None, e)
+        if photo is not None:
+            _forget_file_id(photo)
+        return False
+
+
+@functools.lru_cache(maxsize=PHOTO_CACHE_SIZE)
+def _prepare_photo_cached(path: str, mtime_ns: int) -> bytes:
+    return _prepare_photo_for_telegram(path)
+
+
+def _load_photo_for_telegram(path: str) -> _PreparedPhoto:
+    key = (path, os.stat(path).st_mtime_ns)
+    file_id = _PHOTO_FILE_IDS.get(key)
+    if file_id:
+        return _PreparedPhoto(key, file_id)
+    return _PreparedPhoto(key, _prepare_photo_cached(*key))
+
+
+async def _prepare_photo_safe(index: int, path: str | None) -> _PreparedPhoto | None:
+    if not path:
+        return None
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_PHOTO_EXECUTOR, _load_photo_for_telegram, path)
+    except Exception as e:
+        logger.warning("prepare_photo for ad %s failed: %s", index, e)
+        return None
+
+
+def _build_outgoing(
+    draft: CampaignDraft,
+    ad_blocks: list[str],
+    photos: list[_PreparedPhoto | None],
+) -> list[tuple[str, _PreparedPhoto | None]]:
+    messages: list[tuple[str, _PreparedPhoto | None]] = []
+    pending: list[str] = []
+    for i, (ad, block) in enumerate(zip(draft.ads, ad_blocks)):
+        if photos[i]:
+            messages.extend((part, None) for part in _pack_chunks(pending))
+            pending = []
+            if _tg_len(block) <= CAPTION_LIMIT:
+                messages.append((block, photos[i]))
+                continue
+            messages.append((f"Вариант {i + 1} · {ad.segment_name}", photos[i]))
+        pending.append(block)
+    messages.extend((part, None) for part in _pack_chunks(pending))
+    return messages
+
+
+async def _send_album(app: Application, chat_id: int, album: list[tuple[str, _PreparedPhoto]]) -> int:
+    """Возвращает, сколько фото из album доставлено (начало первой неудавшейся пачки)."""
+    for start in range(0, len(album), MEDIA_GROUP_LIMIT):
+        batch = album[start : start + MEDIA_GROUP_LIMIT]
+        media = [InputMediaPhoto(media=photo.media, caption=caption) for caption, photo in batch]
+        try:
+            sent = await app.bot.send_media_group(chat_id=chat_id, media=media)
+        except Exception as e:
+            logger.warning("send_media_group to chat_id=%s failed, falling back to send_photo: %s", chat_id, e)
+            return start
+        for (_, photo), message in zip(batch, sent):
+            _remember_file_id(photo, message)
+    return len(album)
+
+
+OutgoingItem = tuple[str, _PreparedPhoto | None] | list[tuple[str, _PreparedPhoto]]
+
+
+async def _iter_outgoing(draft: CampaignDraft, chunks: list[str], summary_count: int) -> AsyncIterator[OutgoingItem]:
+    photos_future = asyncio.gather(
+        *(_prepare_photo_safe(i + 1, ad.image_path) for i, ad in enumerate(draft.ads))
+    )
+    for part in _pack_chunks(chunks[:summary_count]):
+        yield part, None
+
+    photos = await photos_future
+    album = [
+        (f"Вариант {i + 1} · {ad.segment_name}", photo)
+        for i, (ad, photo) in enumerate(zip(draft.ads, photos))
+        if photo
+    ]
+    if len(album) > 1:
+        yield album
+        photos = [None] * len(photos)
+    for item in _build_outgoing(draft, chunks[summary_count:], photos):
+        yield item
+
+
+async def _send_or_text(app: Application, chat_id: int, text: str, photo: _PreparedPhoto | None = None) -> None:
+    # Если фото не ушло, подпись (в ней может быть весь текст варианта) отправляем отдельным сообщением.
+    if not await _send_one(app, chat_id, text, photo) and photo is not None:
+        await _send_one(app, chat_id, text)
+
+
+async def _sender(app: Application, chat_id: int, queue: asyncio.Queue) -> None:
+    # Один отправитель на чат, чтобы сообщения шли по порядку.
+    while (item := await queue.get()) is not None:
+        if isinstance(item, list):
+            delivered = await _send_album(app, chat_id, item)
+            for caption, photo in item[delivered:]:
+                await _send_or_text(app, chat_id, caption, photo)
+        else:
+            await _send_or_text(app, chat_id, *item)
+
+
 async def _send_campaign(chat_id: int, draft: CampaignDraft, app: Application) -> None:
     chunks = _format_campaign_message(draft)
     summary_count = sum(
@@ -404,65 +667,15 @@ async def _send_campaign(chat_id: int, draft: CampaignDraft, app: Application) -
             1 if draft.keywords else 0,
         ]
     )
-    for i, part in enumerate(chunks[:summary_count]):
-        if len(part) > MESSAGE_LIMIT:
-            start = 0
-            while start < len(part):
-                await app.bot.send_message(chat_id=chat_id, text=part[start : start + MESSAGE_LIMIT])
-                start += MESSAGE_LIMIT
-        else:
-            await app.bot.send_message(chat_id=chat_id, text=part)
+    queue: asyncio.Queue = asyncio.Queue()
+    sender = asyncio.create_task(_sender(app, chat_id, queue))
+    try:
+        async for item in _iter_outgoing(draft, chunks, summary_count):
+            queue.put_nowait(item)
+    finally:
+        queue.put_nowait(None)
+        await sender
 
-    for i, ad in enumerate(draft.ads):
-        block = chunks[summary_count + i] if summary_count + i < len(chunks) else _format_ad_block(ad, i + 1, draft)
-        if ad.image_path:
-            photo_bytes = None
-            try:
-                photo_bytes = _prepare_photo_for_telegram(ad.image_path)
-            except Exception as e:
-                logger.warning("prepare_photo for ad %s failed: %s", i + 1, e)
-            if photo_bytes:
-                short_caption = f"Вариант {i + 1} · {ad.segment_name}"
-                last_error = None
-                for attempt in range(1, PHOTO_SEND_RETRIES + 1):
-                    try:
-                        await app.bot.send_photo(chat_id=chat_id, photo=photo_bytes, caption=short_caption)
-                        last_error = None
-                        break
-                    except Exception as e:
-                        last_error = e
-                        logger.warning("send_photo for ad %s attempt %s/%s failed: %s", i + 1, attempt, PHOTO_SEND_RETRIES, e)
-                        if attempt < PHOTO_SEND_RETRIES:
-                            await asyncio.sleep(PHOTO_SEND_RETRY_DELAY)
-                if last_error is not None:
-                    await app.bot.send_message(chat_id=chat_id, text=block)
-                else:
-                    if len(block) > MESSAGE_LIMIT:
-                        start = 0
-                        while start < len(block):
-                            part = block[start : start + MESSAGE_LIMIT]
-                            await app.bot.send_message(chat_id=chat_id, text=part)
-                            start += MESSAGE_LIMIT
-                    else:
-                        await app.bot.send_message(chat_id=chat_id, text=block)
-            else:
-                if len(block) > MESSAGE_LIMIT:
-                    start = 0
-                    while start < len(block):
-                        part = block[start : start + MESSAGE_LIMIT]
-                        await app.bot.send_message(chat_id=chat_id, text=part)
-                        start += MESSAGE_LIMIT
-                else:
-                    await app.bot.send_message(chat_id=chat_id, text=block)
-        else:
-            if len(block) > MESSAGE_LIMIT:
-                start = 0
-                while start < len(block):
-                    part = block[start : start + MESSAGE_LIMIT]
-                    await app.bot.send_message(chat_id=chat_id, text=part)
-                    start += MESSAGE_LIMIT
-            else:
-                await app.bot.send_message(chat_id=chat_id, text=block)
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user = update.effective_user
@@ -535,13 +748,8 @@ async def cmd_info(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         lines.append(f"   Дата: {date_str}")
         lines.append(f"   Текст: {desc_short}\n")
     lines.append("Наберите порядковый номер (1–50), чтобы повторно получить сгенерированные варианты по этому заказу.")
-    text = "\n".join(lines)
-    if len(text) > MESSAGE_LIMIT:
-        parts = [text[i : i + MESSAGE_LIMIT] for i in range(0, len(text), MESSAGE_LIMIT)]
-        for part in parts:
-            await update.message.reply_text(part)
-    else:
-        await update.message.reply_text(text)
+    for part in _split_text("\n".join(lines)):
+        await update.message.reply_text(part)
 
 
 async def cmd_balance(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -708,24 +916,24 @@ async def handle_ad_type(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     user_id = None
     telegram_id = update.effective_user.id if update.effective_user else None
     if update.effective_user:
-        user_id = await ensure_user(update.effective_user.id, **_ensure_user_kwargs(update.effective_user))
-        if user_id is not None:
-            await log_action(user_id, LOG_AD_TYPE if not pending_link else LOG_ORDER)
+        user_id = await ensure_user_and_log(
+            update.effective_user.id,
+            LOG_AD_TYPE if not pending_link else LOG_ORDER,
+            **_ensure_user_kwargs(update.effective_user),
+        )
 
     if pending_link and user_id is not None and telegram_id is not None:
-        if not await deduct_balance(telegram_id, GENERATION_COST_RUB):
+        paid, request_id = await deduct_balance_and_create_request(
+            telegram_id, user_id, GENERATION_COST_RUB, pending_link, pending_wishes
+        )
+        if not paid:
             await query.edit_message_text(INSUFFICIENT_BALANCE_MESSAGE)
             context.user_data["pending_link"] = pending_link
             context.user_data["pending_wishes"] = pending_wishes
             return
-        request_id = await create_request(user_id, pending_link, pending_wishes)
         await query.edit_message_text(CREATING_MESSAGE)
         _register_generation(app, chat_id, request_id)
-        asyncio.create_task(
-            _run_campaign_task(
-                chat_id, pending_link, app, pending_wishes, ad_type, user_id, request_id, telegram_id
-            )
-        )
+        _start_campaign_task(chat_id, pending_link, app, pending_wishes, ad_type, user_id, request_id, telegram_id)
     elif pending_link:
         context.user_data["pending_link"] = pending_link
         context.user_data["pending_wishes"] = pending_wishes
@@ -748,8 +956,7 @@ async def handle_link(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         if 1 <= num <= len(request_ids):
             request_id = request_ids[num - 1]
             context.user_data.pop(INFO_REQUEST_IDS_KEY, None)
-            rows = await get_results_for_request(request_id)
-            draft = _draft_from_results(rows) if rows else None
+            draft = await _load_replay_draft(request_id)
             if draft and draft.ads:
                 await update.message.reply_text("Повторная выдача по заказу:")
                 await _send_campaign(update.effective_chat.id, draft, context.application)
@@ -786,42 +993,77 @@ async def handle_link(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     if not user:
         await update.message.reply_text("Ошибка: не удалось определить пользователя.")
         return
-    user_id = await ensure_user(user.id, **_ensure_user_kwargs(user))
+    user_id = await ensure_user_and_log(user.id, LOG_ORDER, **_ensure_user_kwargs(user))
     telegram_id = user.id
     if user_id is None:
         await update.message.reply_text("Ошибка: не удалось определить пользователя.")
         return
-    await log_action(user_id, LOG_ORDER)
-    if not await deduct_balance(telegram_id, GENERATION_COST_RUB):
+    paid, request_id = await deduct_balance_and_create_request(
+        telegram_id, user_id, GENERATION_COST_RUB, link, user_wishes
+    )
+    if not paid:
         await update.message.reply_text(INSUFFICIENT_BALANCE_MESSAGE)
         return
-    request_id = await create_request(user_id, link, user_wishes)
 
     await update.message.reply_text(CREATING_MESSAGE)
     _register_generation(app, chat_id, request_id)
-    asyncio.create_task(
-        _run_campaign_task(chat_id, link, app, user_wishes, ad_type, user_id, request_id, telegram_id)
-    )
+    _start_campaign_task(chat_id, link, app, user_wishes, ad_type, user_id, request_id, telegram_id)
 
 
 async def _on_shutdown(_app: Application) -> None:
     from .db import close_pool
     await close_pool()
+    await close_http_clients()
+    _PHOTO_EXECUTOR.shutdown(wait=False, cancel_futures=True)
+
+
+async def _dispatch_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    data = update.callback_query.data or ""
+    handler = _CALLBACK_HANDLERS.get(data)
+    if handler is None and data.startswith(BALANCE_AMOUNT_PREFIX) and data[len(BALANCE_AMOUNT_PREFIX) :].isdigit():
+        handler = handle_balance_amount
+    if handler is not None:
+        await handler(update, context)
+
+
+_CALLBACK_HANDLERS = {
+    BALANCE_TOPUP_CALLBACK: handle_balance_topup,
+    BALANCE_AMOUNT_CUSTOM: handle_balance_amount,
+    AD_TYPE_SUBSCRIBERS: handle_ad_type,
+    AD_TYPE_MESSAGES: handle_ad_type,
+}
 
 
 def build_application() -> Application:
     from telegram.request import HTTPXRequest
 
     request = HTTPXRequest(
+        connection_pool_size=TELEGRAM_POOL_SIZE,
+        pool_timeout=TELEGRAM_POOL_TIMEOUT,
+        http_version="2",
         read_timeout=30,
         write_timeout=30,
         connect_timeout=10,
         media_write_timeout=120,
     )
+    get_updates_request = HTTPXRequest(
+        connection_pool_size=TELEGRAM_GET_UPDATES_POOL_SIZE,
+        http_version="2",
+    )
     app = (
         Application.builder()
         .token(settings.telegram_bot_token)
         .request(request)
+        .get_updates_request(get_updates_request)
+        .rate_limiter(
+            AIORateLimiter(
+                overall_max_rate=30,
+                overall_time_period=1,
+                group_max_rate=20,
+                group_time_period=60,
+                max_retries=SEND_MAX_RETRIES,
+            )
+        )
         .post_shutdown(_on_shutdown)
         .build()
     )
@@ -829,14 +1071,7 @@ def build_application() -> Application:
     app.add_handler(CommandHandler("create", cmd_create))
     app.add_handler(CommandHandler("info", cmd_info))
     app.add_handler(CommandHandler("balance", cmd_balance))
-    app.add_handler(CallbackQueryHandler(handle_balance_topup, pattern=f"^{re.escape(BALANCE_TOPUP_CALLBACK)}$"))
-    app.add_handler(
-        CallbackQueryHandler(
-            handle_balance_amount,
-            pattern=f"^({re.escape(BALANCE_AMOUNT_CUSTOM)}|{re.escape(BALANCE_AMOUNT_PREFIX)}\\d+)$",
-        )
-    )
-    app.add_handler(CallbackQueryHandler(handle_ad_type, pattern=f"^({AD_TYPE_SUBSCRIBERS}|{AD_TYPE_MESSAGES})$"))
+    app.add_handler(CallbackQueryHandler(_dispatch_callback))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_link))
     return app
 
@@ -849,5 +1084,12 @@ def run_bot() -> None:
     if not settings.llm_api_key:
         raise ValueError("Укажите LLM_API_KEY в .env (OpenAI / DeepSeek / Qwen)")
 
+    try:
+        import uvloop
+    except ImportError:
+        logger.info("uvloop not installed, using default asyncio event loop")
+    else:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
     app = build_application()
     app.run_polling(allowed_updates=Update.ALL_TYPES)
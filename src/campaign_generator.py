@@ -1,11 +1,14 @@
-import json
+import asyncio
 import logging
 from pathlib import Path
 from typing import Any, Optional
 
+import orjson
+
 from .config import settings
 from .image_client import generate_image
-from .llm_client import chat_completion, extract_json_from_text
+from .llm_cache import cached_chat
+from .llm_client import extract_json_from_text
 from .models import AdVariant, CampaignDraft, GroupAnalysis
 from .prompts import (
     SYSTEM_ADS,
@@ -20,6 +23,10 @@ from .prompts import (
 
 logger = logging.getLogger(__name__)
 
+# Сколько запросов по вариантам объявлений (промпт картинки, генерация картинки) идёт к провайдерам одновременно.
+AD_FANOUT_CONCURRENCY = 5
+_AD_FANOUT_SEMAPHORE = asyncio.Semaphore(AD_FANOUT_CONCURRENCY)
+
 
 def _top_posts_for_prompt(analysis: GroupAnalysis, limit: int = 15) -> list[dict[str, Any]]:
     return [
@@ -35,11 +42,18 @@ def _top_posts_for_prompt(analysis: GroupAnalysis, limit: int = 15) -> list[dict
     ]
 
 
-def _segment_description(analysis_result: dict, segment_name: str) -> str:
+def _analysis_json(analysis_result: dict[str, Any]) -> str:
+    return orjson.dumps(analysis_result, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode("utf-8")
+
+
+def _segment_descriptions(analysis_result: dict) -> dict[str, str]:
+    """segment_name -> description; при повторе имени берётся первый сегмент."""
+    descriptions: dict[str, str] = {}
     for seg in analysis_result.get("audience_segments", []):
-        if seg.get("segment_name") == segment_name:
-            return seg.get("description", segment_name)
-    return segment_name
+        name = seg.get("segment_name")
+        if name is not None:
+            descriptions.setdefault(name, seg.get("description", name))
+    return descriptions
 
 
 async def _step1_analysis(
@@ -57,7 +71,7 @@ async def _step1_analysis(
         user_wishes=user_wishes,
         ad_objective=ad_objective,
     )
-    raw = await chat_completion(
+    raw = await cached_chat(
         [{"role": "system", "content": SYSTEM_ANALYSIS}, {"role": "user", "content": user}],
         json_mode=True,
     )
@@ -87,9 +101,9 @@ async def _step1_analysis(
 
 async def _step1b_content_recommendations(analysis_result: dict[str, Any]) -> list[dict[str, str]]:
     logger.info("campaign: step1b_content_recommendations start")
-    analysis_json = json.dumps(analysis_result, ensure_ascii=False, indent=2)
+    analysis_json = _analysis_json(analysis_result)
     user = build_user_content_recommendations(analysis_json)
-    raw = await chat_completion(
+    raw = await cached_chat(
         [
             {"role": "system", "content": SYSTEM_CONTENT_RECOMMENDATIONS},
             {"role": "user", "content": user},
@@ -121,9 +135,9 @@ async def _step2_ads(
     ad_objective: str = "subscribers",
 ) -> list[dict[str, Any]]:
     logger.info("campaign: step2_ads start objective=%s", ad_objective)
-    analysis_json = json.dumps(analysis_result, ensure_ascii=False, indent=2)
+    analysis_json = _analysis_json(analysis_result)
     user = build_user_ads(analysis_json, user_wishes=user_wishes, ad_objective=ad_objective)
-    raw = await chat_completion(
+    raw = await cached_chat(
         [{"role": "system", "content": SYSTEM_ADS}, {"role": "user", "content": user}],
         json_mode=True,
     )
@@ -145,13 +159,41 @@ async def _step3_image_prompt(
     segment_description: str,
 ) -> str:
     user = build_user_image_prompt(headline, visual_concept, segment_description)
-    raw = await chat_completion(
+    raw = await cached_chat(
         [{"role": "system", "content": SYSTEM_IMAGE_PROMPT}, {"role": "user", "content": user}],
         json_mode=False,
     )
     return raw.strip()
 
 
+async def _step3_image_prompt_safe(index: int, headline: str, visual_concept: str, segment_description: str) -> str:
+    async with _AD_FANOUT_SEMAPHORE:
+        try:
+            return await _step3_image_prompt(headline, visual_concept, segment_description)
+        except Exception as e:
+            logger.warning("campaign: image prompt for ad %s failed: %s %s", index, type(e).__name__, e or "(no message)")
+            return ""
+
+
+async def _generate_ad_image(index: int, ad: AdVariant) -> None:
+    async with _AD_FANOUT_SEMAPHORE:
+        try:
+            path = await generate_image(
+                ad.image_prompt,
+                aspect_ratio="1:1",
+            )
+            if path and path.exists():
+                ad.image_path = str(path)
+                logger.info("campaign: image for ad %s saved to %s", index, ad.image_path)
+        except Exception as e:
+            logger.warning(
+                "campaign: image generation for ad %s failed: %s %s",
+                index,
+                type(e).__name__,
+                e or "(no message)",
+            )
+
+
 async def generate_campaign(
     analysis: GroupAnalysis,
     image_path: Optional[Path] = None,
@@ -166,49 +208,38 @@ async def generate_campaign(
     ads_raw = await _step2_ads(analysis_result, user_wishes=user_wishes, ad_objective=ad_objective)
     keywords = analysis_result.get("keywords") or []
 
-    ad_variants: list[AdVariant] = []
-    for a in ads_raw:
-        segment_name = a.get("segment_name") or "Аудитория"
-        headline = a.get("headline") or ""
-        body_text = a.get("body_text") or ""
-        cta = a.get("cta") or ""
-        visual_concept = a.get("visual_concept") or ""
-        image_prompt_short = a.get("image_prompt_short") or ""
-        reasoning = a.get("reasoning") or ""
-        seg_desc = _segment_description(analysis_result, segment_name)
-        image_prompt = await _step3_image_prompt(headline, visual_concept, seg_desc)
-        ad_variants.append(
-            AdVariant(
-                segment_name=segment_name,
-                headline=headline,
-                body_text=body_text,
-                cta=cta,
-                visual_concept=visual_concept,
-                image_prompt_short=image_prompt_short,
-                image_prompt=image_prompt,
-                reasoning=reasoning,
+    ad_variants = [
+        AdVariant(
+            segment_name=a.get("segment_name") or "Аудитория",
+            headline=a.get("headline") or "",
+            body_text=a.get("body_text") or "",
+            cta=a.get("cta") or "",
+            visual_concept=a.get("visual_concept") or "",
+            image_prompt_short=a.get("image_prompt_short") or "",
+            image_prompt=(a.get("image_prompt") or "").strip(),
+            reasoning=a.get("reasoning") or "",
+        )
+        for a in ads_raw
+    ]
+    # Промпт картинки обычно приходит вместе с объявлением; отдельный запрос step3 — только для вариантов без него.
+    # Варианты независимы: недостающие промпты, а затем сами картинки запрашиваем параллельно.
+    missing = [(i, ad) for i, ad in enumerate(ad_variants) if not ad.image_prompt]
+    seg_descriptions = _segment_descriptions(analysis_result) if missing else {}
+    image_prompts = await asyncio.gather(
+        *(
+            _step3_image_prompt_safe(
+                i + 1, ad.headline, ad.visual_concept, seg_descriptions.get(ad.segment_name, ad.segment_name)
             )
+            for i, ad in missing
         )
+    )
+    for (_, ad), image_prompt in zip(missing, image_prompts):
+        ad.image_prompt = image_prompt
 
     if settings.gptunnel_api_key:
-        for i, ad in enumerate(ad_variants):
-            if not ad.image_prompt:
-                continue
-            try:
-                path = await generate_image(
-                    ad.image_prompt,
-                    aspect_ratio="1:1",
-                )
-                if path and path.exists():
-                    ad.image_path = str(path)
-                    logger.info("campaign: image for ad %s saved to %s", i + 1, ad.image_path)
-            except Exception as e:
-                logger.warning(
-                    "campaign: image generation for ad %s failed: %s %s",
-                    i + 1,
-                    type(e).__name__,
-                    e or "(no message)",
-                )
+        await asyncio.gather(
+            *(_generate_ad_image(i + 1, ad) for i, ad in enumerate(ad_variants) if ad.image_prompt)
+        )
 
     logger.info("campaign: generate_campaign done ads=%s", len(ad_variants))
     return CampaignDraft(
@@ -1,3 +1,5 @@
+from functools import lru_cache
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -5,19 +7,28 @@ class Settings(BaseSettings):
     telegram_bot_token: str = ""
     vk_access_token: str = ""
     vk_api_version: str = "5.131"
+    max_concurrent_campaigns: int = 4
 
     llm_api_key: str = ""
     llm_base_url: str = "https://api.openai.com/v1"
     llm_model: str = "gpt-4o-mini"
+    llm_cache_enabled: bool = False
+    llm_cache_ttl_days: int = 7
+    llm_cache_dir: str = "data/llm_cache"
 
     gptunnel_api_key: str = ""
     gptunnel_image_model: str = "google-imagen-4"
 
+    photo_max_size: int = 1024
+    photo_jpeg_quality: int = 75
+    photo_jpeg_progressive: bool = False
+
     mysql_host: str = "localhost"
     mysql_port: int = 3306
     mysql_user: str = ""
     mysql_password: str = ""
     mysql_database: str = ""
+    mysql_pool_size: int = 10
 
     vk_app_secret: str = ""
 
@@ -29,8 +40,13 @@ class Settings(BaseSettings):
     yookassa_webhook_path: str = "/webhook/yookassa"
 
     model_config = SettingsConfigDict(
-        env_file=".env", env_file_encoding="utf-8", extra="ignore"
+        env_file=".env", env_file_encoding="utf-8", extra="ignore", frozen=True
     )
 
 
-settings = Settings()
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    return Settings()
+
+
+settings = get_settings()
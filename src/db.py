@@ -1,4 +1,3 @@
-import json
 import logging
 from contextlib import asynccontextmanager
 from typing import Any, Optional
@@ -12,6 +11,7 @@ LOG_ORDER_DONE = "заказ выполнен"
 INITIAL_BALANCE_RUB = 500
 
 import aiomysql
+import orjson
 
 from .config import settings
 from .models import AdVariant, CampaignDraft
@@ -52,7 +52,7 @@ async def init_pool_if_needed() -> None:
         charset="utf8mb4",
         autocommit=True,
         minsize=1,
-        maxsize=5,
+        maxsize=max(1, settings.mysql_pool_size),
     )
     logger.info("MySQL pool created")
 
@@ -88,7 +88,8 @@ async def get_conn():
         yield conn
 
 
-async def ensure_user(
+async def _upsert_user(
+    cur: aiomysql.Cursor,
     telegram_id: int,
     *,
     first_name: str | None = None,
@@ -98,84 +99,61 @@ async def ensure_user(
     is_bot: bool | None = None,
     is_premium: bool | None = None,
 ) -> Optional[int]:
+    # Один запрос вместо SELECT + UPDATE/INSERT: пустые (None) поля не затирают сохранённые,
+    # id = LAST_INSERT_ID(id) возвращает id существующей строки через lastrowid.
+    await cur.execute(
+        """INSERT INTO users (
+            telegram_id,
+            balance,
+            first_name,
+            last_name,
+            username,
+            language_code,
+            is_bot,
+            is_premium
+        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            id = LAST_INSERT_ID(id),
+            first_name = COALESCE(VALUES(first_name), first_name),
+            last_name = COALESCE(VALUES(last_name), last_name),
+            username = COALESCE(VALUES(username), username),
+            language_code = COALESCE(VALUES(language_code), language_code),
+            is_bot = COALESCE(VALUES(is_bot), is_bot),
+            is_premium = COALESCE(VALUES(is_premium), is_premium)""",
+        (
+            telegram_id,
+            INITIAL_BALANCE_RUB,
+            _truncate(first_name, 255),
+            _truncate(last_name, 255),
+            _truncate(username, 255),
+            _truncate(language_code, 16),
+            _bool_to_int(is_bot),
+            _bool_to_int(is_premium),
+        ),
+    )
+    return cur.lastrowid
+
+
+async def ensure_user(telegram_id: int, **profile: Any) -> Optional[int]:
     await init_pool_if_needed()
     if not _pool_ready():
         return None
     async with get_conn() as conn:
-        async with conn.cursor(aiomysql.DictCursor) as cur:
-            await cur.execute(
-                """SELECT
-                    id,
-                    first_name,
-                    last_name,
-                    username,
-                    language_code,
-                    is_bot,
-                    is_premium
-                FROM users WHERE telegram_id = %s""",
-                (telegram_id,),
-            )
-            row = await cur.fetchone()
-            if row:
-                user_id = int(row["id"])
-                updates: dict[str, Any] = {}
-                db_first = row.get("first_name")
-                db_last = row.get("last_name")
-                db_username = row.get("username")
-                db_lang = row.get("language_code")
-                db_is_bot = row.get("is_bot")
-                db_is_premium = row.get("is_premium")
-
-                new_first = _truncate(first_name, 255)
-                new_last = _truncate(last_name, 255)
-                new_username = _truncate(username, 255)
-                new_lang = _truncate(language_code, 16)
-                new_is_bot = _bool_to_int(is_bot)
-                new_is_premium = _bool_to_int(is_premium)
-
-                if new_first is not None and new_first != db_first:
-                    updates["first_name"] = new_first
-                if new_last is not None and new_last != db_last:
-                    updates["last_name"] = new_last
-                if new_username is not None and new_username != db_username:
-                    updates["username"] = new_username
-                if new_lang is not None and new_lang != db_lang:
-                    updates["language_code"] = new_lang
-                if new_is_bot is not None and new_is_bot != (db_is_bot if db_is_bot is None else int(db_is_bot)):
-                    updates["is_bot"] = new_is_bot
-                if new_is_premium is not None and new_is_premium != (
-                    db_is_premium if db_is_premium is None else int(db_is_premium)
-                ):
-                    updates["is_premium"] = new_is_premium
-
-                if updates:
-                    set_clause = ", ".join(f"{col} = %s" for col in updates.keys())
-                    params = list(updates.values()) + [user_id]
-                    await cur.execute(f"UPDATE users SET {set_clause} WHERE id = %s", params)
-                return user_id
-            await cur.execute(
-                """INSERT INTO users (
-                    telegram_id,
-                    balance,
-                    first_name,
-                    last_name,
-                    username,
-                    language_code,
-                    is_bot,
-                    is_premium
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)""",
-                (
-                    telegram_id,
-                    INITIAL_BALANCE_RUB,
-                    _truncate(first_name, 255),
-                    _truncate(last_name, 255),
-                    _truncate(username, 255),
-                    _truncate(language_code, 16),
-                    _bool_to_int(is_bot),
-                    _bool_to_int(is_premium),
-                ),
-            )
-            return cur.lastrowid
+        async with conn.cursor() as cur:
+            return await _upsert_user(cur, telegram_id, **profile)
+
+
+async def ensure_user_and_log(telegram_id: int, desc: str, **profile: Any) -> Optional[int]:
+    """ensure_user + log_action на одном соединении из пула."""
+    await init_pool_if_needed()
+    if not _pool_ready():
+        return None
+    async with get_conn() as conn:
+        async with conn.cursor() as cur:
+            user_id = await _upsert_user(cur, telegram_id, **profile)
+            if user_id is not None:
+                await _insert_log(cur, user_id, desc)
+            return user_id
 
 
 async def get_user_id_by_telegram(telegram_id: int) -> Optional[int]:
@@ -192,64 +170,92 @@ async def get_user_id_by_telegram(telegram_id: int) -> Optional[int]:
             return int(row["id"]) if row else None
 
 
-async def create_request(user_id: int, link: str, desc: Optional[str] = None) -> Optional[int]:
-    if not _pool_ready():
-        return None
+async def deduct_balance_and_create_request(
+    telegram_id: int,
+    user_id: int,
+    amount: float,
+    link: str,
+    desc: Optional[str] = None,
+) -> tuple[bool, Optional[int]]:
+    """Списывает сумму и создаёт запрос на одном соединении. Возвращает (списано, request_id);
+    если средств не хватило, запрос не создаётся."""
+    await init_pool_if_needed()
+    if not _pool_ready() or amount <= 0:
+        return False, None
     async with get_conn() as conn:
         async with conn.cursor() as cur:
+            await cur.execute(
+                "UPDATE users SET balance = balance - %s WHERE telegram_id = %s AND balance >= %s",
+                (amount, telegram_id, amount),
+            )
+            if cur.rowcount <= 0:
+                return False, None
             await cur.execute(
                 "INSERT INTO requests (user_id, link, `desc`) VALUES (%s, %s, %s)",
                 (user_id, link[:512], desc),
             )
-            return cur.lastrowid
+            return True, cur.lastrowid
 
 
 async def create_results(request_id: int, draft: CampaignDraft) -> None:
-    if not _pool_ready():
+    if not _pool_ready() or not draft.ads:
         return
+    # keywords и analysis_result общие для всех вариантов — храним один раз в requests.result_data.
+    result_data: Optional[str] = None
+    if draft.keywords or draft.analysis_result:
+        data: dict[str, Any] = {}
+        if draft.keywords:
+            data["keywords"] = draft.keywords
+        if draft.analysis_result:
+            data["analysis_result"] = draft.analysis_result
+        result_data = orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    rows = [
+        (
+            request_id,
+            ad.image_path[:1024] if ad.image_path else None,
+            (ad.segment_name or "")[:255],
+            (ad.headline or "")[:512],
+            ad.body_text,
+            (ad.cta or "")[:255],
+            ad.visual_concept,
+            (ad.image_prompt_short or "")[:512],
+            ad.image_prompt,
+        )
+        for ad in draft.ads
+    ]
     async with get_conn() as conn:
         async with conn.cursor() as cur:
-            for ad in draft.ads:
-                result_data: Optional[str] = None
-                if draft.keywords or draft.analysis_result:
-                    data: dict[str, Any] = {}
-                    if draft.keywords:
-                        data["keywords"] = draft.keywords
-                    if draft.analysis_result:
-                        data["analysis_result"] = draft.analysis_result
-                    result_data = json.dumps(data, ensure_ascii=False)
+            if result_data is not None:
                 await cur.execute(
-                    """INSERT INTO results (
-                        request_id, pic, segment_name, headline, body_text,
-                        cta, visual_concept, image_prompt_short, image_prompt, result_data
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)""",
-                    (
-                        request_id,
-                        ad.image_path[:1024] if ad.image_path else None,
-                        (ad.segment_name or "")[:255],
-                        (ad.headline or "")[:512],
-                        ad.body_text,
-                        (ad.cta or "")[:255],
-                        ad.visual_concept,
-                        (ad.image_prompt_short or "")[:512],
-                        ad.image_prompt,
-                        result_data,
-                    ),
+                    "UPDATE requests SET result_data = %s WHERE id = %s",
+                    (result_data, request_id),
                 )
+            # executemany сворачивает INSERT ... VALUES в один многострочный запрос — один round trip на все варианты.
+            await cur.executemany(
+                """INSERT INTO results (
+                    request_id, pic, segment_name, headline, body_text,
+                    cta, visual_concept, image_prompt_short, image_prompt
+                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)""",
+                rows,
+            )
+
+
+async def _insert_log(cur: aiomysql.Cursor, user_id: int, desc: str) -> None:
+    if not desc or len(desc) > 512:
+        desc = desc[:512] if desc else "action"
+    await cur.execute(
+        "INSERT INTO log (user_id, `desc`) VALUES (%s, %s)",
+        (user_id, desc),
+    )
 
 
 async def log_action(user_id: int, desc: str) -> None:
     await init_pool_if_needed()
     if not _pool_ready():
         return
-    if not desc or len(desc) > 512:
-        desc = desc[:512] if desc else "action"
     async with get_conn() as conn:
         async with conn.cursor() as cur:
-            await cur.execute(
-                "INSERT INTO log (user_id, `desc`) VALUES (%s, %s)",
-                (user_id, desc),
-            )
+            await _insert_log(cur, user_id, desc)
 
 
 async def get_user_balance(telegram_id: int) -> Optional[Any]:
@@ -279,20 +285,6 @@ async def add_balance(telegram_id: int, amount: float) -> bool:
             return cur.rowcount > 0
 
 
-async def deduct_balance(telegram_id: int, amount: float) -> bool:
-    """Atomically deduct amount from user balance. Returns True if deduction succeeded (balance was >= amount)."""
-    await init_pool_if_needed()
-    if not _pool_ready() or amount <= 0:
-        return False
-    async with get_conn() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute(
-                "UPDATE users SET balance = balance - %s WHERE telegram_id = %s AND balance >= %s",
-                (amount, telegram_id, amount),
-            )
-            return cur.rowcount > 0
-
-
 async def create_payment_record(
     yookassa_payment_id: str,
     user_id: int,
@@ -373,3 +365,17 @@ async def get_results_for_request(request_id: int) -> list[dict[str, Any]]:
             )
             rows = await cur.fetchall()
             return [dict(r) for r in rows]
+
+
+async def get_request_result_data(request_id: int) -> Optional[str]:
+    await init_pool_if_needed()
+    if not _pool_ready():
+        return None
+    async with get_conn() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                "SELECT result_data FROM requests WHERE id = %s",
+                (request_id,),
+            )
+            row = await cur.fetchone()
+            return row[0] if row else None
@@ -0,0 +1,49 @@
+import logging
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+_LIMITS = httpx.Limits(max_keepalive_connections=32, max_connections=100)
+_IMAGE_LIMITS = httpx.Limits(max_keepalive_connections=20, max_connections=50)
+
+_clients: dict[str, httpx.AsyncClient] = {}
+
+
+def _get_client(name: str, timeout: float, limits: httpx.Limits = _LIMITS) -> httpx.AsyncClient:
+    """Один клиент на внешний сервис: keep-alive соединения (TCP+TLS) переиспользуются между запросами."""
+    client = _clients.get(name)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(timeout=timeout, http2=True, limits=limits)
+        _clients[name] = client
+    return client
+
+
+def get_llm_client() -> httpx.AsyncClient:
+    return _get_client("llm", 120.0)
+
+
+def get_yookassa_client() -> httpx.AsyncClient:
+    return _get_client("yookassa", 15.0)
+
+
+def get_telegram_client() -> httpx.AsyncClient:
+    return _get_client("telegram", 10.0)
+
+
+def get_vk_client() -> httpx.AsyncClient:
+    return _get_client("vk", 30.0)
+
+
+def get_image_client() -> httpx.AsyncClient:
+    return _get_client("image", 130.0, _IMAGE_LIMITS)
+
+
+async def close_http_clients() -> None:
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        try:
+            await client.aclose()
+        except Exception as e:
+            logger.warning("http client close failed: %s", e)
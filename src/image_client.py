@@ -1,18 +1,24 @@
 import asyncio
 import logging
 import os
+import random
 import tempfile
+import time
 from pathlib import Path
 from typing import Optional
 
 import httpx
 
 from .config import settings
+from .http_clients import get_image_client
 
 logger = logging.getLogger(__name__)
 
 GPTUNNEL_MEDIA_BASE = "https://gptunnel.ru/v1/media"
-POLL_INTERVAL = 2.0
+# Опрос статуса с экспоненциальной паузой: быстрые задачи забираем почти сразу, долгие не дёргаем каждые 2 с.
+POLL_INITIAL_DELAY = 0.3
+POLL_BACKOFF = 1.7
+POLL_MAX_DELAY = 5.0
 POLL_MAX_WAIT = 120.0
 
 
@@ -40,50 +46,57 @@ async def generate_image(
     if images:
         body["images"] = images
 
-    async with httpx.AsyncClient(timeout=timeout) as client:
-        resp = await client.post(
-            f"{GPTUNNEL_MEDIA_BASE}/create",
+    client = get_image_client()
+    resp = await client.post(
+        f"{GPTUNNEL_MEDIA_BASE}/create",
+        headers=headers,
+        json=body,
+        timeout=timeout,
+    )
+    resp.raise_for_status()
+    data = resp.json()
+    if data.get("code") != 0:
+        logger.warning("gptunnel create failed: %s", data)
+        return None
+    task_id = data.get("id")
+    if not task_id:
+        logger.warning("gptunnel create: no task id in %s", data)
+        return None
+
+    logger.info("gptunnel task_id=%s polling for result", task_id)
+    delay = POLL_INITIAL_DELAY
+    deadline = time.monotonic() + POLL_MAX_WAIT
+    while time.monotonic() < deadline:
+        await asyncio.sleep(delay + random.uniform(0, delay * 0.1))
+        delay = min(delay * POLL_BACKOFF, POLL_MAX_DELAY)
+        result_resp = await client.post(
+            f"{GPTUNNEL_MEDIA_BASE}/result",
             headers=headers,
-            json=body,
+            json={"task_id": task_id},
+            timeout=timeout,
         )
-        resp.raise_for_status()
-        data = resp.json()
-        if data.get("code") != 0:
-            logger.warning("gptunnel create failed: %s", data)
+        result_resp.raise_for_status()
+        result = result_resp.json()
+        if result.get("code") != 0:
+            logger.warning("gptunnel result failed: %s", result)
             return None
-        task_id = data.get("id")
-        if not task_id:
-            logger.warning("gptunnel create: no task id in %s", data)
+        status = result.get("status")
+        if status == "done":
+            url = result.get("url")
+            if not url:
+                logger.warning("gptunnel result done but no url: %s", result)
+                return None
+            return await _download_image(client, url, output_path)
+        if status in ("failed", "error"):
+            logger.warning("gptunnel task failed: %s", result)
             return None
 
-        logger.info("gptunnel task_id=%s polling for result", task_id)
-        elapsed = 0.0
-        while elapsed < POLL_MAX_WAIT:
-            await asyncio.sleep(POLL_INTERVAL)
-            elapsed += POLL_INTERVAL
-            result_resp = await client.post(
-                f"{GPTUNNEL_MEDIA_BASE}/result",
-                headers=headers,
-                json={"task_id": task_id},
-            )
-            result_resp.raise_for_status()
-            result = result_resp.json()
-            if result.get("code") != 0:
-                logger.warning("gptunnel result failed: %s", result)
-                return None
-            status = result.get("status")
-            if status == "done":
-                url = result.get("url")
-                if not url:
-                    logger.warning("gptunnel result done but no url: %s", result)
-                    return None
-                return await _download_image(client, url, output_path)
-            if status in ("failed", "error"):
-                logger.warning("gptunnel task failed: %s", result)
-                return None
+    logger.warning("gptunnel task timed out task_id=%s", task_id)
+    return None
 
-        logger.warning("gptunnel task timed out task_id=%s", task_id)
-        return None
+
+_CONTENT_TYPE_SUFFIXES = {"image/webp": ".webp", "image/jpeg": ".jpg", "image/png": ".png"}
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
 
 
 async def _download_image(
@@ -91,16 +104,26 @@ async def _download_image(
     url: str,
     output_path: Optional[Path] = None,
 ) -> Optional[Path]:
-    r = await client.get(url)
-    r.raise_for_status()
-    data = r.content
-    if not data:
+    # Пишем картинку в файл по мере получения, не держа всё тело ответа в памяти.
+    async with client.stream("GET", url) as r:
+        r.raise_for_status()
+        if output_path is None:
+            content_type = r.headers.get("content-type", "").split(";", 1)[0].strip().lower()
+            suffix = _CONTENT_TYPE_SUFFIXES.get(content_type) or (".webp" if ".webp" in url else ".png")
+            fd, path = tempfile.mkstemp(suffix=suffix, prefix="ad_")
+            os.close(fd)
+            output_path = Path(path)
+        size = 0
+        try:
+            with output_path.open("wb") as f:
+                async for chunk in r.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+                    size += len(chunk)
+        except BaseException:
+            output_path.unlink(missing_ok=True)
+            raise
+    if not size:
+        output_path.unlink(missing_ok=True)
         return None
-    if output_path is None:
-        suffix = ".webp" if ".webp" in url else ".png"
-        fd, path = tempfile.mkstemp(suffix=suffix, prefix="ad_")
-        os.close(fd)
-        output_path = Path(path)
-    output_path.write_bytes(data)
-    logger.info("saved image to %s (%s bytes)", output_path, len(data))
+    logger.info("saved image to %s (%s bytes)", output_path, size)
     return output_path
@@ -0,0 +1,112 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from pathlib import Path
+
+from .config import settings
+from .llm_client import chat_completion, extract_json_from_text
+
+logger = logging.getLogger(__name__)
+
+PRUNE_INTERVAL = 3600.0
+
+_last_prune = 0.0
+
+
+def _cache_key(messages: list[dict[str, str]], json_mode: bool) -> str:
+    payload = json.dumps(
+        [settings.llm_model, messages, json_mode], ensure_ascii=False, sort_keys=True
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _cache_path(key: str) -> Path:
+    return Path(settings.llm_cache_dir) / f"{key}.json"
+
+
+def _is_expired(path: Path, now: float) -> bool:
+    return now - path.stat().st_mtime > settings.llm_cache_ttl_days * 86400
+
+
+def _read_cached(path: Path) -> str | None:
+    try:
+        if _is_expired(path, time.time()):
+            path.unlink(missing_ok=True)
+            return None
+        return json.loads(path.read_text(encoding="utf-8"))["content"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _prune_expired() -> int:
+    now = time.time()
+    removed = 0
+    for path in Path(settings.llm_cache_dir).glob("*.json"):
+        try:
+            if _is_expired(path, now):
+                path.unlink(missing_ok=True)
+                removed += 1
+        except OSError:
+            continue
+    return removed
+
+
+def _write_cached(path: Path, content: str) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    tmp.write_text(json.dumps({"content": content}, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def _is_cacheable(content: str, json_mode: bool) -> bool:
+    if not content:
+        return False
+    if not json_mode:
+        return True
+    try:
+        extract_json_from_text(content)
+    except ValueError:
+        return False
+    return True
+
+
+async def cached_chat(
+    messages: list[dict[str, str]],
+    *,
+    json_mode: bool = True,
+) -> str:
+    """chat_completion с дисковым кешем ответов по sha256(модель, сообщения, json_mode)."""
+    if not settings.llm_cache_enabled:
+        return await chat_completion(messages, json_mode=json_mode)
+    key = _cache_key(messages, json_mode)
+    path = _cache_path(key)
+    content = await asyncio.to_thread(_read_cached, path)
+    if content is not None and _is_cacheable(content, json_mode):
+        logger.info("LLM cache hit key=%s", key[:12])
+        return content
+    content = await chat_completion(messages, json_mode=json_mode)
+    # Битый или обрезанный JSON не кешируем, иначе повторный заказ получит ту же ошибку.
+    if not _is_cacheable(content, json_mode):
+        logger.info("LLM cache skip invalid reply key=%s", key[:12])
+    else:
+        try:
+            await asyncio.to_thread(_write_cached, path, content)
+        except OSError as e:
+            logger.warning("LLM cache write failed key=%s: %s", key[:12], e)
+        await _maybe_prune()
+    return content
+
+
+async def _maybe_prune() -> None:
+    # Записи, которые больше не читаются, удаляем не чаще раза в PRUNE_INTERVAL.
+    global _last_prune
+    now = time.monotonic()
+    if _last_prune and now - _last_prune < PRUNE_INTERVAL:
+        return
+    _last_prune = now
+    removed = await asyncio.to_thread(_prune_expired)
+    if removed:
+        logger.info("LLM cache pruned %s expired entries", removed)
@@ -1,15 +1,20 @@
 import json
 import logging
+import re
+from functools import lru_cache
 from typing import Any
 
-import httpx
+import orjson
 
 from .config import settings
+from .http_clients import get_llm_client
 
 logger = logging.getLogger(__name__)
 
 DEEPSEEK_MODEL_ALIASES = {"deepseek": "deepseek-chat"}
 
+BRACE_PATTERN = re.compile(r"[{}]")
+
 
 def _resolve_model(name: str) -> str:
     return DEEPSEEK_MODEL_ALIASES.get(name.strip().lower(), name)
@@ -26,12 +31,9 @@ def _log_messages_summary(messages: list[dict[str, str]], max_chars: int = 200)
     return " | ".join(parts)
 
 
-async def chat_completion(
-    messages: list[dict[str, str]],
-    *,
-    json_mode: bool = True,
-    timeout: float = 120.0,
-) -> str:
+@lru_cache(maxsize=1)
+def _llm_endpoint() -> tuple[str, str, dict[str, str]]:
+    """URL, модель и заголовки считаются один раз: настройки неизменяемы."""
     base = settings.llm_base_url.rstrip("/")
     if "/v1" not in base and "deepseek" in base.lower():
         base = f"{base}/v1"
@@ -40,7 +42,16 @@ async def chat_completion(
         "Authorization": f"Bearer {settings.llm_api_key}",
         "Content-Type": "application/json",
     }
-    model = _resolve_model(settings.llm_model)
+    return url, _resolve_model(settings.llm_model), headers
+
+
+async def chat_completion(
+    messages: list[dict[str, str]],
+    *,
+    json_mode: bool = True,
+    timeout: float = 120.0,
+) -> str:
+    url, model, headers = _llm_endpoint()
     body: dict[str, Any] = {
         "model": model,
         "messages": messages,
@@ -49,21 +60,21 @@ async def chat_completion(
     if json_mode:
         body["response_format"] = {"type": "json_object"}
 
-    logger.info(
-        "LLM request: url=%s model=%s messages_count=%s json_mode=%s timeout=%s | %s",
-        url,
-        model,
-        len(messages),
-        json_mode,
-        timeout,
-        _log_messages_summary(messages),
-    )
-
-    async with httpx.AsyncClient(timeout=timeout) as client:
-        resp = await client.post(url, headers=headers, json=body)
-        resp.raise_for_status()
-
-    data = resp.json()
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(
+            "LLM request: url=%s model=%s messages_count=%s json_mode=%s timeout=%s | %s",
+            url,
+            model,
+            len(messages),
+            json_mode,
+            timeout,
+            _log_messages_summary(messages),
+        )
+
+    resp = await get_llm_client().post(url, headers=headers, content=orjson.dumps(body), timeout=timeout)
+    resp.raise_for_status()
+
+    data = orjson.loads(resp.content)
     msg = data["choices"][0].get("message") or {}
     content = msg.get("content") or ""
     reasoning = msg.get("reasoning_content") or ""
@@ -71,7 +82,7 @@ async def chat_completion(
     if not content and reasoning:
         content = reasoning
         logger.info("LLM: using reasoning_content as content (content was empty)")
-    content = (content or "").strip()
+    content = content.strip()
     usage = data.get("usage") or {}
     logger.info(
         "LLM response: status=%s content_len=%s reasoning_len=%s usage=%s",
@@ -97,13 +108,14 @@ def _find_json_objects(text: str) -> list[tuple[int, int]]:
             break
         depth = 0
         end = -1
-        for j in range(start, len(text)):
-            if text[j] == "{":
+        # Регулярка пропускает текст между скобками в C, цикл идёт только по самим скобкам.
+        for m in BRACE_PATTERN.finditer(text, start):
+            if m.group() == "{":
                 depth += 1
-            elif text[j] == "}":
+            else:
                 depth -= 1
                 if depth == 0:
-                    end = j + 1
+                    end = m.end()
                     break
         if end != -1:
             spans.append((start, end))
@@ -115,6 +127,14 @@ def _find_json_objects(text: str) -> list[tuple[int, int]]:
 
 def extract_json_from_text(text: str) -> dict[str, Any]:
     text = text.strip()
+    # В json_mode ответ обычно сам является JSON-объектом: пробуем его целиком, без поиска скобок.
+    try:
+        data = orjson.loads(text)
+    except orjson.JSONDecodeError:
+        pass
+    else:
+        if isinstance(data, dict):
+            return data
     spans = _find_json_objects(text)
     if not spans:
         raise ValueError("JSON object not found in response")
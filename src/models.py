@@ -30,7 +30,7 @@ class GroupAnalysis:
     top_posts_by_engagement: list[PostStats] = field(default_factory=list)
 
 
-@dataclass
+@dataclass(slots=True)
 class AdVariant:
     segment_name: str
     headline: str
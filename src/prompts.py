@@ -178,6 +178,7 @@ SYSTEM_ADS = """Ты — специалист по таргетированно
 - Четкий CTA под выбранный тип
 - Без клише и чрезмерных обещаний
 - Для каждого объявления укажи краткое обоснование (2–3 предложения): на основе каких данных анализа выбран этот сегмент, угол подачи и формулировки — чтобы было видно, что вариант опирается на анализ, а не придуман случайно.
+- Для каждого объявления дай детальный prompt для генерации рекламного изображения (image_prompt) по заголовку, визуальной концепции и сегменту: фотореалистичный стиль, формат рекламного баннера 1:1, без текста внутри изображения, без логотипов и водяных знаков, композиция с местом под заголовок сверху, яркое освещение, высокая детализация.
 
 Ответ строго в JSON:
 
@@ -190,6 +191,7 @@ SYSTEM_ADS = """Ты — специалист по таргетированно
       "cta": "...",
       "visual_concept": "...",
       "image_prompt_short": "краткое описание для картинки",
+      "image_prompt": "детальный prompt для генерации изображения",
       "reasoning": "краткое обоснование: почему этот сегмент, угол и формулировки (с опорой на анализ)"
     }
   ]
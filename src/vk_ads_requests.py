@@ -3,10 +3,12 @@ Builds VK Ads API request payloads from CampaignDraft.
 These are the exact request bodies that would be sent to VK Ads API.
 """
 
-import json
 import logging
+import re
 from typing import Any
 
+import orjson
+
 from .models import AdVariant, CampaignDraft
 
 logger = logging.getLogger(__name__)
@@ -14,12 +16,29 @@ logger = logging.getLogger(__name__)
 CAMPAIGN_TYPE_DEFAULT = 1
 AD_FORMAT_COMMUNITY_POST = 9
 
+AD_GROUP_PLACEHOLDER_PREFIX = "{{ad_group_id"
+# {{ad_group_id}} — по порядку, {{ad_group_id_N}} — N-й элемент ad_group_ids.
+AD_GROUP_PLACEHOLDER_PATTERN = re.compile(r"\{\{ad_group_id(?:_(\d+))?\}\}")
+
+
+def _dumps(value: Any) -> str:
+    return orjson.dumps(value).decode("utf-8")
+
 
 def _get_vk_campaign(draft: CampaignDraft) -> dict[str, Any]:
     return draft.analysis_result.get("vk_campaign") or {}
 
 
-def _targeting_for_segment(segment: dict, vk: dict) -> dict[str, Any]:
+def _base_targeting(vk: dict) -> dict[str, Any]:
+    base: dict[str, Any] = {"country": vk.get("country") or "1"}
+    if vk.get("region_ids"):
+        base["regions"] = vk.get("region_ids")
+    if vk.get("interest_ids"):
+        base["interest_ids"] = vk.get("interest_ids")
+    return base
+
+
+def _targeting_for_segment(segment: dict, vk: dict, base: dict[str, Any]) -> dict[str, Any]:
     age_range = (segment.get("age_range") or "").strip()
     age_from = vk.get("age_from", 18)
     age_to = vk.get("age_to", 55)
@@ -35,17 +54,7 @@ def _targeting_for_segment(segment: dict, vk: dict) -> dict[str, Any]:
     elif gender == "female":
         sex = 2
 
-    targeting: dict[str, Any] = {
-        "age_from": age_from,
-        "age_to": age_to,
-        "sex": sex,
-        "country": vk.get("country") or "1",
-    }
-    if vk.get("region_ids"):
-        targeting["regions"] = vk.get("region_ids")
-    if vk.get("interest_ids"):
-        targeting["interest_ids"] = vk.get("interest_ids")
-    return targeting
+    return {"age_from": age_from, "age_to": age_to, "sex": sex, **base}
 
 
 def build_vk_ads_requests(
@@ -79,7 +88,7 @@ def build_vk_ads_requests(
         "method": "ads.createCampaigns",
         "params": {
             "account_id": account_id,
-            "data": json.dumps(campaign_data, ensure_ascii=False),
+            "data": _dumps(campaign_data),
         },
     })
 
@@ -87,16 +96,16 @@ def build_vk_ads_requests(
     if not segments and draft.ads:
         segments = [{"segment_name": ad.segment_name, "description": ""} for ad in draft.ads]
 
+    base_targeting = _base_targeting(vk)
     ad_groups_data = []
     for i, seg in enumerate(segments):
         name = seg.get("segment_name") or f"Группа {i + 1}"
-        targeting = _targeting_for_segment(seg, vk)
         ad_groups_data.append({
             "name": name[:100],
             "campaign_id": "{{campaign_id}}",
             "day_limit": str(day_limit) if day_limit else "0",
             "bid": str(bid),
-            "targeting": json.dumps(targeting, ensure_ascii=False),
+            "targeting": _dumps(_targeting_for_segment(seg, vk, base_targeting)),
         })
 
     requests_out.append({
@@ -104,7 +113,7 @@ def build_vk_ads_requests(
         "params": {
             "account_id": account_id,
             "campaign_id": "{{campaign_id}}",
-            "data": json.dumps(ad_groups_data, ensure_ascii=False),
+            "data": _dumps(ad_groups_data),
         },
     })
 
@@ -136,13 +145,25 @@ def build_vk_ads_requests(
         "method": "ads.createAds",
         "params": {
             "account_id": account_id,
-            "data": json.dumps(ads_data, ensure_ascii=False),
+            "data": _dumps(ads_data),
         },
     })
 
     return requests_out
 
 
+def _resolve_ad_group_ids(data_str: str, ad_group_ids: list[str]) -> str:
+    ordered = iter(ad_group_ids)
+
+    def replace(m: re.Match[str]) -> str:
+        if m.group(1) is None:
+            return next(ordered, m.group(0))
+        index = int(m.group(1))
+        return ad_group_ids[index] if index < len(ad_group_ids) else m.group(0)
+
+    return AD_GROUP_PLACEHOLDER_PATTERN.sub(replace, data_str)
+
+
 def build_vk_ads_requests_with_placeholders_resolved(
     draft: CampaignDraft,
     account_id: str = "0",
@@ -163,8 +184,14 @@ def build_vk_ads_requests_with_placeholders_resolved(
         if "data" in params:
             data_str = params["data"]
             data_str = data_str.replace("{{campaign_id}}", campaign_id)
-            for i, gid in enumerate(ad_group_ids):
-                data_str = data_str.replace("{{ad_group_id}}", gid, 1)
+            if ad_group_ids and AD_GROUP_PLACEHOLDER_PREFIX in data_str:
+                data_str = _resolve_ad_group_ids(data_str, ad_group_ids)
+                if AD_GROUP_PLACEHOLDER_PREFIX in data_str:
+                    logger.warning(
+                        "%s: unresolved ad_group_id placeholders (ad_group_ids=%s)",
+                        r["method"],
+                        len(ad_group_ids),
+                    )
             params["data"] = data_str
         if "campaign_id" in params and params["campaign_id"] == "{{campaign_id}}":
             params["campaign_id"] = campaign_id
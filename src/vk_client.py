@@ -1,17 +1,31 @@
+import heapq
 import logging
 import re
-import urllib.parse
 from typing import Any, Optional
 
-import requests
-import vk_api
+import orjson
 
 from .config import settings
+from .http_clients import get_vk_client
 from .models import GroupAnalysis, GroupInfo, PostStats
 
 logger = logging.getLogger(__name__)
 
 VK_API_BASE = "https://api.vk.com/method"
+TOP_POSTS_LIMIT = 10
+
+# groups.getById и wall.get одним запросом через execute (VKScript).
+GROUP_AND_WALL_CODE = (
+    "var g = API.groups.getById({\"group_ids\": %s});"
+    "var w = API.wall.get({\"owner_id\": -g[0].id, \"count\": %d, \"filter\": \"owner\"});"
+    "return {\"groups\": g, \"wall\": w};"
+)
+
+GROUP_LINK_PATTERN = re.compile(
+    r"(?:https?://)?(?:www\.|m\.)?vk\.(?:com|ru)/"
+    r"(?:(?:club|public|event)?(?P<id>\d+)|(?P<name>[a-zA-Z0-9_.-]+))",
+    re.IGNORECASE,
+)
 
 
 def _parse_group_id_or_screen_name(link: str) -> Optional[str]:
@@ -20,18 +34,23 @@ def _parse_group_id_or_screen_name(link: str) -> Optional[str]:
     link = link.strip().rstrip("/")
     if not link:
         return None
-    domain = r"vk\.(?:com|ru)"
-    patterns = [
-        rf"(?:https?://)?(?:www\.)?{domain}/(?:club|public|event)?(\d+)",
-        rf"(?:https?://)?(?:www\.)?{domain}/([a-zA-Z0-9_.-]+)",
-        rf"(?:https?://)?(?:m\.)?{domain}/(?:club|public)?(\d+)",
-        rf"(?:https?://)?(?:m\.)?{domain}/([a-zA-Z0-9_.-]+)",
-    ]
-    for pattern in patterns:
-        m = re.search(pattern, link, re.IGNORECASE)
-        if m:
-            return m.group(1)
-    return None
+    m = GROUP_LINK_PATTERN.search(link)
+    if not m:
+        return None
+    return m.group("id") or m.group("name")
+
+
+async def _vk_call(method: str, **params: Any) -> Any:
+    params.update(access_token=settings.vk_access_token, v=settings.vk_api_version)
+    resp = await get_vk_client().post(f"{VK_API_BASE}/{method}", data=params)
+    resp.raise_for_status()
+    data = orjson.loads(resp.content)
+    err = data.get("error") or (data.get("execute_errors") or [None])[0]
+    if err:
+        msg = err.get("error_msg", "Unknown VK API error")
+        code = err.get("error_code", 0)
+        raise RuntimeError(f"[{code}] {msg}")
+    return data.get("response")
 
 
 def _engagement(likes: int, comments: int, reposts: int, views: int) -> float:
@@ -40,7 +59,7 @@ def _engagement(likes: int, comments: int, reposts: int, views: int) -> float:
     return (likes + comments * 2 + reposts * 3) / views
 
 
-def fetch_group_analysis(link: str, posts_count: int = 50) -> GroupAnalysis:
+async def fetch_group_analysis(link: str, posts_count: int = 50) -> GroupAnalysis:
     logger.info("vk: fetch_group_analysis link=%s posts_count=%s", link, posts_count)
     if not link or not isinstance(link, str) or not link.strip():
         raise ValueError("Ссылка на группу не указана или пуста")
@@ -53,27 +72,12 @@ def fetch_group_analysis(link: str, posts_count: int = 50) -> GroupAnalysis:
     # group_id accepts only numeric ID; for screen name (domain) use group_ids only
     logger.info("vk: group ids: %s", group_id_value)
     
-    params_for_query: dict[str, str] = {
-        "access_token": settings.vk_access_token,
-        "v": settings.vk_api_version,
-        "group_ids": group_id_value,
-    }
-    query = urllib.parse.urlencode(params_for_query)
-    url = f"{VK_API_BASE}/groups.getById?{query}"
-    resp = requests.get(url, timeout=30)
-    resp.raise_for_status()
-    data = resp.json()
-    if "error" in data:
-        err = data["error"]
-        msg = err.get("error_msg", "Unknown VK API error")
-        code = err.get("error_code", 0)
-        raise RuntimeError(f"[{code}] {msg}")
-    groups_raw = data.get("response") or []
+    script = GROUP_AND_WALL_CODE % (orjson.dumps(group_id_value).decode("utf-8"), posts_count)
+    response = await _vk_call("execute", code=script) or {}
+    groups_raw = response.get("groups") or []
     if not groups_raw:
         raise ValueError("Группа не найдена")
-
-    vk = vk_api.VkApi(token=settings.vk_access_token, api_version=settings.vk_api_version)
-    api = vk.get_api()
+    wall = response.get("wall") or {}
 
     g = groups_raw[0]
     group = GroupInfo(
@@ -85,9 +89,6 @@ def fetch_group_analysis(link: str, posts_count: int = 50) -> GroupAnalysis:
         status=g.get("status", {}).get("text", "") if isinstance(g.get("status"), dict) else str(g.get("status", "")),
     )
 
-    owner_id = -group.id
-    wall = api.wall.get(owner_id=owner_id, count=posts_count, filter="owner")
-
     posts: list[PostStats] = []
     for item in wall.get("items", []):
         likes = item.get("likes", {}).get("count", 0)
@@ -108,6 +109,6 @@ def fetch_group_analysis(link: str, posts_count: int = 50) -> GroupAnalysis:
             )
         )
 
-    top = sorted(posts, key=lambda p: p.engagement, reverse=True)[:10]
+    top = heapq.nlargest(TOP_POSTS_LIMIT, posts, key=lambda p: p.engagement)
     logger.info("vk: done group=%s members=%s posts=%s top=%s", group.name, group.members_count, len(posts), len(top))
     return GroupAnalysis(group=group, posts=posts, top_posts_by_engagement=top)
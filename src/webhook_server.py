@@ -1,7 +1,6 @@
-import json
 import logging
 
-import httpx
+import orjson
 from aiohttp import web
 
 from .config import settings
@@ -11,11 +10,22 @@ from .db import (
     init_pool_if_needed,
     set_payment_succeeded,
 )
+from .http_clients import close_http_clients, get_telegram_client
 
 logger = logging.getLogger(__name__)
 
 TELEGRAM_SEND_MESSAGE = "https://api.telegram.org/bot{token}/sendMessage"
 
+# Тела постоянных ответов сериализуются один раз; сам Response нельзя переиспользовать между запросами.
+OK_BODY = orjson.dumps({"status": "ok"})
+IGNORED_BODY = orjson.dumps({"status": "ignored"})
+INVALID_JSON_BODY = orjson.dumps({"error": "Invalid JSON"})
+MISSING_ID_BODY = orjson.dumps({"error": "Missing object.id"})
+
+
+def _json_response(body: bytes, status: int = 200) -> web.Response:
+    return web.Response(body=body, status=status, content_type="application/json")
+
 
 async def on_startup(app: web.Application) -> None:
     await init_pool_if_needed()
@@ -24,50 +34,51 @@ async def on_startup(app: web.Application) -> None:
 async def on_cleanup(app: web.Application) -> None:
     from .db import close_pool
     await close_pool()
+    await close_http_clients()
 
 
 async def handle_yookassa_webhook(request: web.Request) -> web.Response:
     try:
         body = await request.read()
-        data = json.loads(body) if body else {}
-    except json.JSONDecodeError as e:
+        data = orjson.loads(body) if body else {}
+    except orjson.JSONDecodeError as e:
         logger.warning("YooKassa webhook invalid JSON: %s", e)
-        return web.json_response({"error": "Invalid JSON"}, status=400)
+        return _json_response(INVALID_JSON_BODY, status=400)
     event = data.get("event")
     if event != "payment.succeeded":
-        return web.json_response({"status": "ignored"})
+        return _json_response(IGNORED_BODY)
     obj = data.get("object") or {}
     payment_id = obj.get("id")
     if not payment_id:
-        return web.json_response({"error": "Missing object.id"}, status=400)
+        return _json_response(MISSING_ID_BODY, status=400)
     await init_pool_if_needed()
     record = await get_payment_by_yookassa_id(payment_id)
     if not record:
         logger.warning("YooKassa webhook unknown payment_id=%s", payment_id)
-        return web.json_response({"status": "ok"})
+        return _json_response(OK_BODY)
     if record.get("status") != "pending":
-        return web.json_response({"status": "ok"})
+        return _json_response(OK_BODY)
     telegram_id = int(record["telegram_id"])
     amount = float(record["amount_rub"])
     updated = await set_payment_succeeded(payment_id)
     if not updated:
-        return web.json_response({"status": "ok"})
+        return _json_response(OK_BODY)
     if not await add_balance(telegram_id, amount):
         logger.error("add_balance failed telegram_id=%s amount=%s", telegram_id, amount)
     token = settings.telegram_bot_token
     if token:
         try:
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                await client.post(
-                    TELEGRAM_SEND_MESSAGE.format(token=token),
-                    json={
-                        "chat_id": telegram_id,
-                        "text": f"Баланс успешно пополнен на {amount:.2f} ₽. Спасибо!",
-                    },
-                )
+            await get_telegram_client().post(
+                TELEGRAM_SEND_MESSAGE.format(token=token),
+                content=orjson.dumps({
+                    "chat_id": telegram_id,
+                    "text": f"Баланс успешно пополнен на {amount:.2f} ₽. Спасибо!",
+                }),
+                headers={"Content-Type": "application/json"},
+            )
         except Exception as e:
             logger.warning("Failed to send Telegram notification: %s", e)
-    return web.json_response({"status": "ok"})
+    return _json_response(OK_BODY)
 
 
 def create_app() -> web.Application:
@@ -1,10 +1,11 @@
 import logging
-import uuid
+import secrets
 from typing import Any
 
 import httpx
 
 from .config import settings
+from .http_clients import get_yookassa_client
 
 logger = logging.getLogger(__name__)
 
@@ -61,21 +62,20 @@ async def create_payment(
         },
     }
     headers = {
-        "Idempotence-Key": str(uuid.uuid4()),
+        "Idempotence-Key": secrets.token_hex(16),
         "Content-Type": "application/json",
     }
     auth = (shop_id, secret_key)
     try:
-        async with httpx.AsyncClient(timeout=15.0) as client:
-            resp = await client.post(
-                YOOKASSA_API,
-                json=payload,
-                headers=headers,
-                auth=auth,
-            )
-            body = resp.text
-            resp.raise_for_status()
-            data = resp.json()
+        resp = await get_yookassa_client().post(
+            YOOKASSA_API,
+            json=payload,
+            headers=headers,
+            auth=auth,
+        )
+        body = resp.text
+        resp.raise_for_status()
+        data = resp.json()
     except httpx.HTTPStatusError as e:
         logger.warning(
             "YooKassa create payment HTTP %s: %s",